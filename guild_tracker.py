@@ -1,9 +1,22 @@
 import csv
+import functools
+import heapq
 import json
 import subprocess
+import sys
+import tempfile
 from datetime import date
+from operator import itemgetter
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # orjson er valgfri - ellers bruges stdlib json
+    orjson = None
+
+# orjson.JSONDecodeError arver fra json.JSONDecodeError, så fejlhåndtering er den samme
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 # === PATHS ===
 
 ROOT = Path(__file__).parent
@@ -12,48 +25,194 @@ RUST_BINARY = ROOT / "sf_fetcher" / "target" / "release" / "sf_fetcher"
 
 DATA_DIR = ROOT / "data"
 CSV_PATH = DATA_DIR / "guild_levels.csv"
+DATES_PATH = DATA_DIR / "dates.txt"
+
+# Under denne størrelse læses hele CSV-filen; ellers kun halen bagfra
+CSV_TAIL_MIN_BYTES = 1 << 20
+CSV_TAIL_BLOCK_SIZE = 1 << 16
+
+# Dagens dato formateres én gang ved import (scriptet kører én gang i døgnet)
+_TODAY = date.today().isoformat()
 
 
 # === HJÆLPEFUNKTIONER (DATA) ===
 
-def _load_csv_rows():
-    """Læs alle rækker fra CSV-fil, eller returnér tom liste hvis ikke findes/ingen data."""
+@functools.lru_cache(maxsize=1)
+def _load_csv_partitions_cached(path, mtime, size):
+    """Parse CSV-filen én gang til (partitions, dates).
+
+    partitions er opdelt pr. dato: date -> {name: level}, så en
+    analyse kun rører de datoer, den kigger på. dates er de sorterede,
+    unikke datoer.
+
+    Nøglen (path, mtime, size) sørger for, at cachen bliver ugyldig,
+    når filen ændres (fx efter append_today).
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Spring header over
+        partitions = _partition_rows(reader)
+    return partitions, tuple(sorted(partitions))
+
+
+@functools.lru_cache(maxsize=2)
+def _load_csv_tail_cached(path, mtime, size, window_dates):
+    """Læs CSV-filen bagfra i blokke, indtil alle window_dates er med.
+
+    Forudsætter, at filen er append-only i datoorden. Vi stopper, når vi
+    møder en dato før window_dates[0], så den ældste dato i vinduet er
+    komplet.
+    """
+    first_date = window_dates[0].encode("utf-8")
+    blocks = []
+    remainder = b""
+    reached_older = False
+    with open(path, "rb") as f:
+        pos = size
+        while pos > 0 and not reached_older:
+            read_size = min(CSV_TAIL_BLOCK_SIZE, pos)
+            pos -= read_size
+            f.seek(pos)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            if pos > 0:
+                # Første linje kan være delvis - den hører til næste blok
+                remainder = lines.pop(0)
+            else:
+                lines.pop(0)  # Spring header over
+            for line in lines:
+                if line.strip() and line.split(b",", 1)[0] < first_date:
+                    reached_older = True
+                    break
+            blocks.append(lines)
+
+    text = b"\n".join(
+        line for lines in reversed(blocks) for line in lines
+    ).decode("utf-8")
+    # Kun vinduets datoer parses; rækker fra ældre datoer springes over før int()
+    partitions = _partition_rows(csv.reader(text.splitlines()), set(window_dates))
+    window_dates = tuple(d for d in window_dates if d in partitions)
+    return {d: partitions[d] for d in window_dates}, window_dates
+
+
+def _last_csv_date():
+    """Returnér datoen på sidste række i CSV-fil (læser kun den sidste blok)."""
+    size = CSV_PATH.stat().st_size
+    with CSV_PATH.open("rb") as f:
+        f.seek(max(0, size - CSV_TAIL_BLOCK_SIZE))
+        lines = f.read().splitlines()
+    for line in reversed(lines):
+        if line.strip():
+            return line.split(b",", 1)[0].decode("utf-8")
+    return None
+
+
+def _load_dates_index(rebuild=False):
+    """Læs datoindekset (én sorteret dato pr. linje i DATES_PATH).
+
+    Indekset genopbygges fra CSV-filen, hvis rebuild er sat, eller hvis det
+    mangler eller ikke slutter med samme dato som CSV-filen.
+    """
     if not CSV_PATH.exists():
         return []
-    with CSV_PATH.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+    if not rebuild and DATES_PATH.exists():
+        dates = DATES_PATH.read_text(encoding="utf-8").splitlines()
+        if dates and dates[-1] == _last_csv_date():
+            return dates
 
+    _partitions, dates = _load_csv_partitions()
+    if dates:
+        DATES_PATH.write_text("".join(f"{d}\n" for d in dates), encoding="utf-8")
+    return list(dates)
 
-def _build_levels_by_key(rows, window_dates):
-    """Lav mapping (date, name) -> level for de datoer, vi kigger på."""
-    levels_by_key = {}
-    window_dates_set = set(window_dates)
-    for row in rows:
-        d = row.get("date")
-        if d not in window_dates_set:
+
+def _partition_rows(reader, wanted_dates=None):
+    """Opdel CSV-rækker (uden header) i date -> {name: level}.
+
+    Hvis wanted_dates er givet, springes andre datoer over, før level parses.
+    Spillernavne interneres, så hvert navn kun findes én gang i hukommelsen
+    på tværs af alle datopartitioner.
+    """
+    partitions = {}
+    for row in reader:
+        if len(row) < 3:
             continue
-        try:
-            lvl = int(row["level"])
-        except (ValueError, TypeError, KeyError):
+        d, name, level = row[0], row[1], row[2]
+        if not d or not name:
             continue
-        name = row.get("name")
-        if not name:
+        if wanted_dates is not None and d not in wanted_dates:
             continue
-        levels_by_key[(d, name)] = lvl
-    return levels_by_key
+        try:
+            lvl = int(level)
+        except ValueError:
+            # Skipper rækker, der ikke kan parses som int
+            continue
+        partition = partitions.get(d)
+        if partition is None:
+            partition = partitions[d] = {}
+        partition[sys.intern(name)] = lvl
+    return partitions
 
 
-def _players_with_full_window(levels_by_key, window_dates):
-    """Yield (name, [levels i kronologisk rækkefølge]) for spillere med komplette data."""
-    players = sorted({name for (_d, name) in levels_by_key.keys()})
-    for name in players:
-        levels_for_player = [
-            levels_by_key.get((d, name)) for d in window_dates
-        ]
-        if any(lvl is None for lvl in levels_for_player):
-            continue
-        yield name, levels_for_player
+def _load_csv_partitions():
+    """Læs CSV-fil som (partitions, dates), eller tomme værdier hvis ikke findes/ingen data."""
+    if not CSV_PATH.exists():
+        return {}, ()
+    stat = CSV_PATH.stat()
+    return _load_csv_partitions_cached(
+        str(CSV_PATH), stat.st_mtime_ns, stat.st_size
+    )
+
+
+def _load_csv_tail(n_days):
+    """Læs kun de sidste n_days datoer fra CSV-fil som (partitions, dates).
+
+    Datoerne i vinduet slås op i datoindekset. Nævner indekset en dato,
+    som CSV-filen ikke har rækker for (fx efter en redigering midt i
+    filen), genopbygges indekset, og vinduet læses igen.
+    """
+    window_dates = tuple(_load_dates_index()[-n_days:])
+    if not window_dates:
+        return {}, ()
+    partitions, found_dates = _load_csv_window(window_dates)
+    if found_dates != window_dates:
+        window_dates = tuple(_load_dates_index(rebuild=True)[-n_days:])
+        if not window_dates:
+            return {}, ()
+        partitions, found_dates = _load_csv_window(window_dates)
+    return partitions, found_dates
+
+
+def _load_csv_window(window_dates):
+    """Læs rækkerne for window_dates fra CSV-fil som (partitions, dates).
+
+    Små filer (< CSV_TAIL_MIN_BYTES) læses helt via den cachede fulde
+    parse; store filer læses bagfra, så kun vinduets rækker parses.
+    """
+    stat = CSV_PATH.stat()
+    if stat.st_size < CSV_TAIL_MIN_BYTES:
+        partitions, _dates = _load_csv_partitions()
+        window_dates = tuple(d for d in window_dates if d in partitions)
+        return {d: partitions[d] for d in window_dates}, window_dates
+    return _load_csv_tail_cached(
+        str(CSV_PATH), stat.st_mtime_ns, stat.st_size, window_dates
+    )
+
+
+def _window_deltas(partitions, window_dates):
+    """Lav liste af (name, level første dag, level sidste dag, delta) i vinduet.
+
+    Kun første og sidste dato bruges til udviklingen, så mellemliggende
+    datoer springes helt over. Spillere, der mangler på en af de to
+    datoer, droppes. Delta beregnes i samme gennemløb som opslagene.
+    """
+    first_day = partitions[window_dates[0]]
+    last_day = partitions[window_dates[-1]]
+    deltas = []
+    for name in sorted(first_day.keys() & last_day.keys()):
+        first = first_day[name]
+        last = last_day[name]
+        deltas.append((name, first, last, last - first))
+    return deltas
 
 
 # === HJÆLPEFUNTIONER (OUTPUT) ===
@@ -79,24 +238,16 @@ def _print_table(headers, rows, title=None):
         for i, cell in enumerate(row):
             col_widths[i] = max(col_widths[i], len(str(cell)))
 
-    # Header
-    header_line = " | ".join(
-        f"{headers[i]:<{col_widths[i]}}" for i in range(len(headers))
-    )
-    separator_line = "-+-".join(
-        "-" * col_widths[i] for i in range(len(headers))
-    )
+    # Formatstreng bygges én gang og genbruges til header og alle rækker
+    row_fmt = " | ".join(f"{{:<{w}}}" for w in col_widths)
+    separator_line = "-+-".join("-" * w for w in col_widths)
 
-    print(header_line)
+    print(row_fmt.format(*headers))
     print(separator_line)
 
     # Rækker
     for row in rows:
-        print(
-            " | ".join(
-                f"{str(row[i]):<{col_widths[i]}}" for i in range(len(headers))
-            )
-        )
+        print(row_fmt.format(*map(str, row)))
     print()  # Tom linje efter tabel
 
 
@@ -110,40 +261,46 @@ def fetch_levels():
             "Har du kørt `cargo build --release` i sf_fetcher-mappen?"
         )
 
-    result = subprocess.run(
-        [str(RUST_BINARY)],
-        capture_output=True,
-        text=True,
-    )
+    # Rust skriver JSON direkte til en fil, som læses som rå bytes; så
+    # bliver output hverken bufferet i en pipe eller dekodet til str først.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = Path(tmp_dir) / "levels.json"
+        result = subprocess.run(
+            [str(RUST_BINARY), "--output", str(output_path)],
+            capture_output=True,
+        )
 
-    if result.returncode != 0:
-        raise RuntimeError(
-            "Rust-program fejlede.\n"
-            f"Exit code: {result.returncode}\n"
-            f"STDOUT:\n{result.stdout}\n"
-            f"STDERR:\n{result.stderr}"
+        if result.returncode != 0:
+            raise RuntimeError(
+                "Rust-program fejlede.\n"
+                f"Exit code: {result.returncode}\n"
+                f"STDOUT:\n{result.stdout.decode('utf-8', errors='replace')}\n"
+                f"STDERR:\n{result.stderr.decode('utf-8', errors='replace')}"
+            )
+
+        # Ældre builds kender ikke --output og printer stadig til stdout
+        output = (
+            output_path.read_bytes() if output_path.exists() else result.stdout
         )
 
     try:
-        data = json.loads(result.stdout)
-    except json.JSONDecodeError as e:
+        data = _json_loads(output)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
         raise ValueError(
-            f"Kunne ikke parse JSON fra Rust-programmet:\n{e}\nOutput var:\n{result.stdout}"
+            f"Kunne ikke parse JSON fra Rust-programmet:\n{e}\n"
+            f"Output var:\n{output.decode('utf-8', errors='replace')}"
         )
 
-    levels = []
-    for item in data:
-        name = item.get("name")
-        level = item.get("level")
-        if name is None or level is None:
-            continue
-        try:
-            levels.append({"name": name, "level": int(level)})
-        except (ValueError, TypeError):
-            # Skipper entries, der ikke kan parses som int
-            continue
-
-    return levels
+    # Rust-programmet serialiserer allerede {name: str, level: heltal}, så
+    # elementerne genbruges direkte; kun entries med forkerte typer skippes.
+    # `type(...) is int` afviser også bool, som ellers er en underklasse af int.
+    return [
+        item
+        for item in data
+        if isinstance(item, dict)
+        and isinstance(item.get("name"), str)
+        and type(item.get("level")) is int
+    ]
 
 
 def append_today(levels):
@@ -152,36 +309,48 @@ def append_today(levels):
         print("Ingen levels at gemme i dag.")
         return
 
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    if not DATA_DIR.is_dir():
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-    today = date.today().isoformat()
+    today = _TODAY
     file_exists = CSV_PATH.exists()
+    # Valider/genopbyg indekset mod CSV-filen, før dagens rækker tilføjes
+    dates = _load_dates_index()
 
-    with CSV_PATH.open("a", newline="", encoding="utf-8") as f:
+    with CSV_PATH.open("a", buffering=1 << 20, newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         if not file_exists:
             writer.writerow(["date", "name", "level"])
 
-        for m in levels:
-            writer.writerow([today, m["name"], m["level"]])
+        writer.writerows((today, m["name"], m["level"]) for m in levels)
+
+    if not dates:
+        # Ny (eller tom) CSV: overskriv et evt. forældet indeks i stedet for at appende
+        DATES_PATH.write_text(f"{today}\n", encoding="utf-8")
+    elif dates[-1] != today:
+        with DATES_PATH.open("a", encoding="utf-8") as f:
+            f.write(f"{today}\n")
 
     print(f"[LOG] Gemte {len(levels)} linjer i {CSV_PATH}\n")
 
 
-def analyze_last_n_days(n_days, top_n):
+def analyze_last_n_days(n_days, top_n, snapshot=None):
     """Find hvem der har udviklet sig mest/mindst over de sidste n dage.
 
-    Inkluderer KUN spillere, der har data for ALLE datoer i vinduet.
+    Inkluderer KUN spillere, der har data for både første og sidste dato i vinduet.
+    snapshot er et allerede indlæst (partitions, dates) fra _load_csv_tail,
+    der dækker mindst n_days datoer; ellers læses CSV-filen her.
     """
-    rows = _load_csv_rows()
-    if not rows:
+    if snapshot is None:
+        snapshot = _load_csv_tail(n_days)
+    partitions, dates = snapshot
+    if not partitions:
         if not CSV_PATH.exists():
             print("Ingen CSV-fil endnu - ingen analyse.\n")
         else:
             print("CSV er tom - ingen analyse.\n")
         return
 
-    dates = sorted({row["date"] for row in rows if row.get("date")})
     if len(dates) < 2:
         print("Mindre end 2 dage med data - ikke så meget at analysere endnu.\n")
         return
@@ -192,32 +361,25 @@ def analyze_last_n_days(n_days, top_n):
     print(f"ANALYSE: Udvikling over de sidste {len(window_dates)} dage")
     print("=" * 60)
 
-    levels_by_key = _build_levels_by_key(rows, window_dates)
-
-    changes = []
-    for name, levels_for_player in _players_with_full_window(levels_by_key, window_dates):
-        oldest_level = levels_for_player[0]
-        newest_level = levels_for_player[-1]
-        delta = newest_level - oldest_level
-        changes.append(
-            {
-                "name": name,
-                "from": oldest_level,
-                "to": newest_level,
-                "delta": delta,
-            }
-        )
+    changes = [
+        {
+            "name": name,
+            "from": oldest_level,
+            "to": newest_level,
+            "delta": delta,
+        }
+        for name, oldest_level, newest_level, delta
+        in _window_deltas(partitions, window_dates)
+    ]
 
     if not changes:
-        print("Ingen spillere med komplette data i perioden.\n")
+        print("Ingen spillere med data i både start og slut af perioden.\n")
         return
 
-    changes_sorted = sorted(changes, key=lambda c: c["delta"])
-
     print(f"Antal spillere i analysen: {len(changes)}\n")
 
     # Mindst udvikling
-    worst = changes_sorted[:top_n]
+    worst = heapq.nsmallest(top_n, changes, key=itemgetter("delta"))
     worst_rows = [
         [
             i,
@@ -235,7 +397,8 @@ def analyze_last_n_days(n_days, top_n):
     )
 
     # Mest udvikling
-    best = list(reversed(changes_sorted))[:top_n]
+    # reversed(): ved lige delta kommer spillerne i omvendt navneorden
+    best = heapq.nlargest(top_n, reversed(changes), key=itemgetter("delta"))
     best_rows = [
         [
             i,
@@ -253,21 +416,23 @@ def analyze_last_n_days(n_days, top_n):
     )
 
 
-def project_levels_next_7_days(top_n=10):
+def project_levels_next_7_days(top_n=10, snapshot=None):
     """Projekter hvilket level spillere er på om 7 dage,
     givet at de udvikler sig som de sidste 7 dage.
 
-    Inkluderer KUN spillere, der har data for ALLE 7 datoer i vinduet.
+    Inkluderer KUN spillere, der har data for både første og sidste af de 7 datoer.
+    snapshot fungerer som i analyze_last_n_days.
     """
-    rows = _load_csv_rows()
-    if not rows:
+    if snapshot is None:
+        snapshot = _load_csv_tail(7)
+    partitions, dates = snapshot
+    if not partitions:
         if not CSV_PATH.exists():
             print("Ingen CSV-fil endnu - ingen projektion.\n")
         else:
             print("CSV er tom - ingen projektion.\n")
         return
 
-    dates = sorted({row["date"] for row in rows if row.get("date")})
     if len(dates) < 7:
         print("Mindre end 7 dages data - kan ikke lave 7-dages projektion endnu.\n")
         return
@@ -278,31 +443,23 @@ def project_levels_next_7_days(top_n=10):
     print("PROJEKTION: Forventet level om 7 dage")
     print("=" * 60)
 
-    levels_by_key = _build_levels_by_key(rows, window_dates)
-
-    projections = []
-    for name, levels_for_player in _players_with_full_window(levels_by_key, window_dates):
-        oldest_level = levels_for_player[0]
-        newest_level = levels_for_player[-1]
-        delta = newest_level - oldest_level
-        projected_level = newest_level + delta
-
-        projections.append(
-            {
-                "name": name,
-                "from": oldest_level,
-                "current": newest_level,
-                "delta": delta,
-                "projected": projected_level,
-            }
-        )
+    projections = [
+        {
+            "name": name,
+            "from": oldest_level,
+            "current": newest_level,
+            "delta": delta,
+            "projected": newest_level + delta,
+        }
+        for name, oldest_level, newest_level, delta
+        in _window_deltas(partitions, window_dates)
+    ]
 
     if not projections:
-        print("Ingen spillere med komplette 7-dages data - ingen projektion.\n")
+        print("Ingen spillere med data i både start og slut af de 7 dage - ingen projektion.\n")
         return
 
-    projections_sorted = sorted(projections, key=lambda p: p["projected"])
-    worst = projections_sorted[:top_n]
+    worst = heapq.nsmallest(top_n, projections, key=itemgetter("projected"))
 
     rows = [
         [
@@ -333,14 +490,17 @@ def main():
 
     append_today(levels)
 
+    # Læs de sidste 7 dage én gang og del dem mellem alle analyser
+    snapshot = _load_csv_tail(7)
+
     # 3-dages analyse
-    analyze_last_n_days(n_days=3, top_n=10)
+    analyze_last_n_days(n_days=3, top_n=10, snapshot=snapshot)
 
     # 7-dages analyse
-    analyze_last_n_days(n_days=7, top_n=10)
+    analyze_last_n_days(n_days=7, top_n=10, snapshot=snapshot)
 
     # 7-dages projektion
-    project_levels_next_7_days(top_n=10)
+    project_levels_next_7_days(top_n=10, snapshot=snapshot)
 
 
 if __name__ == "__main__":
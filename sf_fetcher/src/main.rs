@@ -3,6 +3,7 @@ use serde::Serialize;
 // Bemærk: "command" og ikke "commands"
 use sf_api::{command::Command, SimpleSession};
 use std::env;
+use std::fs;
 
 #[derive(Serialize)]
 struct MemberLevel {
@@ -15,6 +16,13 @@ async fn main() -> Result<(), Box<dyn std::error::Error>> {
     // Indlæs .env fra mappen
     dotenv().ok();
 
+    // Valgfrit: `--output <sti>` skriver JSON til en fil i stedet for stdout
+    let args: Vec<String> = env::args().collect();
+    let output_path = args
+        .iter()
+        .position(|arg| arg == "--output")
+        .and_then(|i| args.get(i + 1));
+
     // Du logger ALTID ind med SF account (email + password)
     let username = env::var("SF_USERNAME")
         .expect("SF_USERNAME mangler (din S&F account e-mail)");
@@ -49,9 +57,12 @@ async fn main() -> Result<(), Box<dyn std::error::Error>> {
         })
         .collect();
 
-    // 6) Print JSON til stdout (det læser Python-scriptet senere)
-    let json = serde_json::to_string_pretty(&members)?;
-    println!("{json}");
+    // 6) Skriv kompakt JSON til fil eller stdout (det læser Python-scriptet senere)
+    let json = serde_json::to_string(&members)?;
+    match output_path {
+        Some(path) => fs::write(path, json)?,
+        None => println!("{json}"),
+    }
 
     Ok(())
 }
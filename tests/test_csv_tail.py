@@ -0,0 +1,56 @@
+import csv
+import shutil
+import tempfile
+import unittest
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
+
+import guild_tracker
+
+
+class LoadCsvTailTest(unittest.TestCase):
+    """Halen læst bagfra skal give det samme som den fulde parse."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = Path(tempfile.mkdtemp())
+        cls.csv_path = cls.tmp_dir / "guild_levels.csv"
+        # csv.writer skriver CRLF; navne med komma (citeres) og multi-byte tegn
+        names = [f"Spiller{i}" for i in range(40)] + ["Kråget", "Slůně", "gówniak", "Bø, x"]
+        start = date(2025, 1, 1)
+        with cls.csv_path.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["date", "name", "level"])
+            for day in range(120):
+                d = (start + timedelta(days=day)).isoformat()
+                writer.writerows((d, name, day + i) for i, name in enumerate(names))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def tearDown(self):
+        guild_tracker._load_csv_tail_cached.cache_clear()
+
+    def test_tail_matches_full_parse(self):
+        path = str(self.csv_path)
+        size = self.csv_path.stat().st_size
+        full_partitions, full_dates = guild_tracker._load_csv_partitions_cached(path, 0, size)
+
+        for block_size in (7, 50, 1000, 1 << 16):
+            for n_days in (1, 3, 7, 200):
+                guild_tracker._load_csv_tail_cached.cache_clear()
+                with mock.patch.object(guild_tracker, "CSV_TAIL_BLOCK_SIZE", block_size):
+                    partitions, dates = guild_tracker._load_csv_tail_cached(
+                        path, 0, size, full_dates[-n_days:]
+                    )
+                with self.subTest(block_size=block_size, n_days=n_days):
+                    self.assertEqual(dates, full_dates[-n_days:])
+                    self.assertEqual(
+                        partitions, {d: full_partitions[d] for d in dates}
+                    )
+
+
+if __name__ == "__main__":
+    unittest.main()